@@ -1,29 +1,49 @@
 from __future__ import annotations
 
+import atexit
+import hashlib
 import json
+import os
+import shutil
+import tempfile
+import uuid
+from datetime import datetime
+
+import pyarrow as pa
 import streamlit as st
 import pandas as pd
 
 from merge_utils import (
+    validate_file_size,
     load_file,
     do_merge,
+    prune_merge_inputs,
     anti_join,
+    encode_keys,
     filter_columns,
     build_summary_stats,
     to_excel_bytes,
     to_csv_bytes,
+    to_feather_bytes,
     sanitize_filename,
     extract_base_name,
     detect_key_columns,
+    key_column_stats,
     validate_data_before_merge,
     normalize_data,
     detect_duplicates,
     analyze_data_quality,
+    estimate_memory_mb,
     aggregate_columns,
     fix_duplicate_columns,
+    search_haystack,
+    contains_any,
 )
 
 
+# Copy-on-Write: head()/selecciones de columnas no copian datos hasta que se modifican
+pd.options.mode.copy_on_write = True
+
 st.set_page_config(page_title="Data Merge Tool", layout="wide", page_icon="🔗")
 
 
@@ -43,7 +63,9 @@ def init_state():
         "join_type": "inner",
         "cols_from_a": None,
         "cols_from_b": None,
-        "resultado": None,
+        "resultado": None,  # Solo se usa si el resultado no se pudo guardar como Parquet
+        "resultado_path": None,  # Parquet en disco con el último resultado
+        "resultado_token": None,  # Cambia con cada resultado nuevo (clave de las descargas cacheadas)
         "suffixes": ("_A", "_B"),
         "normalize_data": False,
         "normalize_columns_a": [],
@@ -54,6 +76,12 @@ def init_state():
         "validation_results": None,
         "should_generate": False,
         "preserve_format": True,  # Por defecto preservar formatos
+        "df_a_token": None,  # Identifica la versión actual de df_a para las funciones cacheadas
+        "df_b_token": None,
+        "upload_token_a": None,  # Archivo + opciones con que se cargó df_a
+        "upload_token_b": None,
+        "upload_spill_a": None,  # Parquet con la base A ya parseada (se reutiliza si se vuelve a subir)
+        "upload_spill_b": None,
     }
     for k, v in defaults.items():
         if k not in st.session_state:
@@ -62,6 +90,357 @@ def init_state():
 
 init_state()
 
+# Máximo de filas usadas para el análisis de calidad que se muestra en la interfaz
+QUALITY_SAMPLE_ROWS = 200_000
+# A partir de este tamaño se ofrece además la descarga en formato Feather
+FEATHER_MIN_ROWS = 200_000
+# Espacio máximo en disco para bases parseadas y resultados guardados (todas las sesiones)
+SPILL_MAX_MB = 1024
+
+
+@st.cache_resource(show_spinner=False)
+def _spill_dir() -> str:
+    # Directorio propio del proceso (no el /tmp compartido); se elimina al terminar el servidor
+    path = tempfile.mkdtemp(prefix="merge_data_")
+    atexit.register(shutil.rmtree, path, ignore_errors=True)
+    return path
+
+
+def _evict_spills(keep: set) -> None:
+    # Streamlit no avisa cuando termina una sesión: los archivos de sesiones antiguas se
+    # eliminan por antigüedad cuando el directorio supera SPILL_MAX_MB
+    entries = []
+    with os.scandir(_spill_dir()) as it:
+        for entry in it:
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= SPILL_MAX_MB * 1024 * 1024:
+            break
+        if path in keep:
+            continue
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def _store_df(side: str, df: pd.DataFrame) -> None:
+    # Cada versión del DataFrame recibe un token nuevo para invalidar las funciones cacheadas
+    st.session_state[f"df_{side}"] = df
+    st.session_state[f"df_{side}_token"] = uuid.uuid4().hex
+
+
+def _df_token(side: str) -> str:
+    if st.session_state.get(f"df_{side}_token") is None:
+        st.session_state[f"df_{side}_token"] = uuid.uuid4().hex
+    return st.session_state[f"df_{side}_token"]
+
+
+def _normalize_once(side: str, df: pd.DataFrame, columns: list) -> pd.DataFrame:
+    # Solo normalizar columnas que aún no se normalizaron desde que se cargó el archivo
+    columns = columns or df.columns.tolist()
+    normalized = st.session_state.get(f"_normalized_cols_{side}", set())
+    pending = [col for col in columns if col not in normalized]
+    if not pending:
+        return df
+    # El DataFrame de la sesión es propio (no compartido con la caché): se modifica sin copiar
+    df = normalize_data(df, pending, copy=False)
+    _store_df(side, df)
+    st.session_state[f"_normalized_cols_{side}"] = normalized | set(pending)
+    return df
+
+
+def _spill(name: str, df: pd.DataFrame):
+    # Guardar el DataFrame como Parquet (zstd) en disco; None si Parquet no soporta sus tipos
+    path = os.path.join(_spill_dir(), f"merge_data_{uuid.uuid4().hex}_{name}.parquet")
+    try:
+        df.to_parquet(path, compression="zstd")
+    except (ValueError, TypeError, pa.ArrowException):
+        if os.path.exists(path):
+            os.unlink(path)
+        return None
+    _evict_spills(_session_spills() | {path})
+    return path
+
+
+def _stash(name: str, path, df: pd.DataFrame = None) -> None:
+    # La sesión guarda solo la ruta del Parquet; el DataFrame en memoria es el último recurso
+    # (p. ej. columnas con valores mezclados). El archivo anterior no se borra aquí: puede
+    # seguir referenciado por la caché de resultados y se elimina al liberar espacio.
+    st.session_state[name] = None if path else df
+    st.session_state[f"{name}_path"] = path
+    # Mismo archivo, mismo token: las descargas cacheadas se reutilizan
+    st.session_state[f"{name}_token"] = os.path.basename(path) if path else uuid.uuid4().hex
+
+
+def _session_spills() -> set:
+    # Archivos en disco que usa la sesión actual (no se eliminan al liberar espacio)
+    keys = ("resultado_path", "upload_spill_a", "upload_spill_b")
+    return {st.session_state.get(k) for k in keys} - {None}
+
+
+def _unstash(name: str):
+    path = st.session_state.get(f"{name}_path")
+    if path and os.path.exists(path):
+        return _read_stash(path)
+    return st.session_state.get(name)
+
+
+def _load_upload(side: str, uploaded_file, name: str, preserve_format: bool, max_size_mb: int) -> pd.DataFrame:
+    # El archivo se vuelca a disco por bloques de 1 MB (pandas lee desde una ruta en lugar de
+    # copiar el buffer) y a la vez se calcula el hash del contenido
+    validate_file_size(uploaded_file, max_size_mb)
+    uploaded_file.seek(0)
+    digest = hashlib.blake2b(digest_size=16)
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(name)[1], dir=_spill_dir(), delete=False) as tmp:
+        for block in iter(lambda: uploaded_file.read(1 << 20), b""):
+            digest.update(block)
+            tmp.write(block)
+        path = tmp.name
+    # El mismo contenido con las mismas opciones ya se parseó: leer el Parquet mapeado en memoria
+    spill = os.path.join(
+        _spill_dir(), f"merge_data_upload_{digest.hexdigest()}_{int(preserve_format)}.parquet"
+    )
+    try:
+        if os.path.exists(spill):
+            os.utime(spill)  # Uso reciente: es lo último en eliminarse
+            df = pd.read_parquet(spill, memory_map=True)
+            # Parquet devuelve el texto ArrowDtype como StringDtype: restaurar el tipo con que se cargó
+            text_cols = {col: pd.ArrowDtype(pa.string()) for col, dtype in df.dtypes.items() if isinstance(dtype, pd.StringDtype)}
+            if text_cols:
+                df = df.astype(text_cols)
+        else:
+            df = load_file(path, max_size_mb=max_size_mb, preserve_format=preserve_format)
+            try:
+                df.to_parquet(spill, compression="zstd")
+            except (ValueError, TypeError, pa.ArrowException):
+                # Tipos o nombres de columna que Parquet no soporta: no se guarda copia
+                if os.path.exists(spill):
+                    os.unlink(spill)
+                spill = None
+    finally:
+        os.unlink(path)
+    old_spill = st.session_state.get(f"upload_spill_{side}")
+    if old_spill and old_spill != spill and os.path.exists(old_spill):
+        os.unlink(old_spill)
+    st.session_state[f"upload_spill_{side}"] = spill
+    _evict_spills(_session_spills())
+    return df
+
+
+# LRU compartido: solo los últimos resultados leídos se mantienen en memoria
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _read_stash(path: str) -> pd.DataFrame:
+    return pd.read_parquet(path)
+
+
+# Las descargas se serializan una vez por resultado, no en cada rerun
+@st.cache_data(max_entries=2, show_spinner=False)
+def _cached_excel(_df: pd.DataFrame, result_token: str) -> bytes:
+    return to_excel_bytes(_df)
+
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def _cached_csv(_df: pd.DataFrame, result_token: str) -> bytes:
+    return to_csv_bytes(_df)
+
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def _cached_feather(_df: pd.DataFrame, result_token: str) -> bytes:
+    return to_feather_bytes(_df)
+
+
+@st.cache_data(show_spinner=False)
+def _cached_quality(_df: pd.DataFrame, df_token: str) -> dict:
+    # En bases grandes el análisis es aproximado: se calcula sobre una muestra
+    if len(_df) <= QUALITY_SAMPLE_ROWS:
+        quality = analyze_data_quality(_df)
+        quality["sampled"] = False
+    else:
+        quality = analyze_data_quality(_df.sample(n=QUALITY_SAMPLE_ROWS, random_state=0))
+        quality["total_rows"] = len(_df)
+        # La memoria sí se estima sobre el DataFrame completo
+        quality["memory_usage_mb"] = estimate_memory_mb(_df)
+        quality["sampled"] = True
+    # Formatear una sola vez; los reruns reutilizan el dict cacheado
+    quality["null_display"] = {
+        k: f"{v:.1f}%" for k, v in quality["null_percentages"].items() if v > 0
+    }
+    return quality
+
+
+@st.cache_data(show_spinner=False)
+def _preview_arrow(_df: pd.DataFrame, df_token: str, n: int) -> pd.DataFrame:
+    return _df.head(n)
+
+
+@st.cache_data(show_spinner=False)
+def _col_compare(cols_a: tuple, cols_b: tuple) -> tuple:
+    # Solo se recalcula cuando cambia el esquema de alguna de las bases.
+    # Las operaciones de Index conservan el orden original de las columnas.
+    index_a, index_b = pd.Index(cols_a), pd.Index(cols_b)
+    common = index_a.intersection(index_b, sort=False)
+    unique_a = index_a.difference(index_b, sort=False)
+    unique_b = index_b.difference(index_a, sort=False)
+    return common.tolist(), unique_a.tolist(), unique_b.tolist()
+
+
+@st.cache_data(show_spinner=False)
+def _key_stats(_df: pd.DataFrame, df_token: str, col: str) -> dict:
+    return key_column_stats(_df[col])
+
+
+@st.cache_data(show_spinner=False)
+def _cached_validate(_df_a, _df_b, df_a_token: str, df_b_token: str, keys_a: tuple, keys_b: tuple) -> dict:
+    return validate_data_before_merge(_df_a, _df_b, list(keys_a), list(keys_b))
+
+
+class _UnspilledResult(Exception):
+    # El resultado no se pudo guardar como Parquet: se devuelve sin pasar por la caché
+    def __init__(self, df: pd.DataFrame, stats: dict):
+        super().__init__("resultado sin guardar en disco")
+        self.df = df
+        self.stats = stats
+
+
+# La caché guarda solo la ruta del Parquet y las estadísticas, no el DataFrame
+@st.cache_data(max_entries=4, show_spinner=False)
+def _cached_merge(_df_a, _df_b, df_a_token, df_b_token, keys_a, keys_b, how, suffixes, cols_from_a, cols_from_b):
+    # Los tokens identifican los DataFrames; el resultado solo se recalcula si cambian las entradas
+    key_a = keys_a[0] if isinstance(keys_a, list) else keys_a
+    key_b = keys_b[0] if isinstance(keys_b, list) else keys_b
+    key_codes = None
+    
+    if how in {"inner", "left", "right", "outer"}:
+        # Descartar antes del merge las columnas que no se van a conservar
+        merge_a, merge_b = prune_merge_inputs(_df_a, _df_b, keys_a, keys_b, cols_from_a, cols_from_b)
+        merged = do_merge(merge_a, merge_b, keys_a, keys_b, how=how, suffixes=suffixes)
+        filtered = filter_columns(
+            merged,
+            cols_from_a=cols_from_a,
+            cols_from_b=cols_from_b,
+            key_a=key_a,
+            key_b=key_b,
+            suffixes=suffixes,
+        )
+        stats_how = how
+    elif how == "anti A vs B":
+        # Con una sola llave, el anti join y las estadísticas comparten la misma codificación
+        if isinstance(keys_a, str) or len(keys_a) == 1:
+            key_codes = encode_keys(_df_a, _df_b, key_a, key_b)
+        result = anti_join(_df_a, _df_b, keys_a, keys_b, direction="A_not_in_B", key_codes=key_codes)
+        filtered = result.loc[:, pd.Index(cols_from_a).intersection(result.columns, sort=False)]
+        stats_how = "anti_A_vs_B"
+    elif how == "anti B vs A":
+        if isinstance(keys_a, str) or len(keys_a) == 1:
+            key_codes = encode_keys(_df_a, _df_b, key_a, key_b)
+        result = anti_join(_df_a, _df_b, keys_a, keys_b, direction="B_not_in_A", key_codes=key_codes)
+        filtered = result.loc[:, pd.Index(cols_from_b).intersection(result.columns, sort=False)]
+        stats_how = "anti_B_vs_A"
+    else:
+        raise ValueError(f"Tipo de join no soportado: {how}")
+    
+    # Corregir columnas duplicadas si existen
+    filtered = fix_duplicate_columns(filtered)
+    stats = build_summary_stats(_df_a, _df_b, key_a, key_b, stats_how, filtered, key_codes=key_codes)
+    path = _spill("resultado", filtered)
+    if path is None:
+        raise _UnspilledResult(filtered, stats)
+    return path, stats
+
+
+@st.cache_data(show_spinner=False)
+def _cached_key_columns(_df: pd.DataFrame, df_token: str) -> list:
+    return detect_key_columns(_df)
+
+
+def _download_slot(df_result: pd.DataFrame, fmt: str, builder, label: str, file_name: str, mime: str, help: str = None) -> None:
+    # El archivo solo se genera cuando el usuario lo pide; luego queda cacheado por resultado
+    token = st.session_state["resultado_token"]
+    prepared = st.session_state.get("downloads_prepared")
+    if not prepared or prepared[0] != token:
+        prepared = (token, set())
+        st.session_state["downloads_prepared"] = prepared
+    # El botón de descarga reemplaza al de preparar en el mismo lugar
+    slot = st.empty()
+    if fmt not in prepared[1]:
+        if not slot.button(f"⚙️ Preparar {label}", key=f"prepare_{fmt}", use_container_width=True, help=help):
+            return
+        prepared[1].add(fmt)
+    try:
+        with st.spinner(f"Generando {label}..."):
+            data = builder(df_result, token)
+        slot.download_button(
+            label=f"📥 Descargar {label}",
+            data=data,
+            file_name=sanitize_filename(file_name),
+            mime=mime,
+            use_container_width=True,
+            help=help,
+        )
+    except Exception as e:
+        slot.error(f"No se pudo preparar el archivo {label}: {e}")
+
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _cached_haystack(_df: pd.DataFrame, result_token: str) -> pa.Array:
+    # Texto de cada fila ya unido y en minúsculas: se arma una vez por resultado, no en cada tecla
+    return search_haystack(_df)
+
+
+# La búsqueda y la vista previa se re-ejecutan solas, sin volver a correr todo el script
+@st.fragment
+def _preview_fragment(df_result: pd.DataFrame) -> None:
+    # Búsqueda y filtrado
+    search_col1, search_col2 = st.columns([2, 1])
+    with search_col1:
+        search_term = st.text_input("🔍 Buscar en los datos", key="search_term")
+    with search_col2:
+        max_rows_preview = st.number_input("Filas a mostrar", min_value=10, max_value=1000, value=50, step=10)
+
+    # Filtrar por término de búsqueda
+    df_display = df_result
+    if search_term:
+        # Buscar en todas las columnas de tipo string, por bloques crecientes:
+        # se detiene en cuanto hay coincidencias suficientes para la vista previa
+        haystack = _cached_haystack(df_result, st.session_state["resultado_token"])
+        matches = []
+        found = 0
+        scanned = 0
+        window = max_rows_preview * 20
+        while scanned < len(df_result) and found < max_rows_preview:
+            chunk = df_result.iloc[scanned:scanned + window]
+            hits = chunk.iloc[contains_any(chunk, search_term, haystack=haystack.slice(scanned, len(chunk)))]
+            matches.append(hits)
+            found += len(hits)
+            scanned += len(chunk)
+            window *= 2
+        df_display = pd.concat(matches) if matches else df_result.iloc[:0]
+        if scanned < len(df_result):
+            st.info(
+                f"Mostrando las primeras {found:,} filas que coinciden con '{search_term}' "
+                f"(revisadas {scanned:,} de {len(df_result):,} filas)"
+            )
+        else:
+            st.info(f"Mostrando {len(df_display):,} filas que coinciden con '{search_term}'")
+
+    # Verificar y corregir columnas duplicadas antes de mostrar
+    if df_display.columns.duplicated().any():
+        st.warning("⚠️ Se detectaron columnas con nombres duplicados. Se renombrarán automáticamente para la visualización.")
+        df_display = fix_duplicate_columns(df_display)
+
+    st.write(f"**Total de filas:** {len(df_result):,}")
+    if len(df_display) > 0:
+        st.dataframe(df_display.head(max_rows_preview), use_container_width=True)
+    else:
+        st.warning("No hay resultados que coincidan con la búsqueda")
+
 
 # Sidebar para configuración avanzada
 with st.sidebar:
@@ -145,34 +524,42 @@ with tab1:
                 
                 with st.spinner(f"Cargando {base_name_display_a}..."):
                     preserve_format = st.session_state.get("preserve_format", True)
-                    df_a = load_file(uploaded_a, max_size_mb=max_file_size, preserve_format=preserve_format)
-                    st.session_state["df_a"] = df_a
-                    
-                    # Analizar calidad de datos
-                    st.session_state["data_quality_a"] = analyze_data_quality(df_a)
+                    # Solo volver a leer si cambió el archivo o las opciones de lectura
+                    upload_token_a = f"{uploaded_a.file_id}:{preserve_format}:{max_file_size}"
+                    if st.session_state.get("upload_token_a") != upload_token_a or st.session_state.get("df_a") is None:
+                        df_a = _load_upload("a", uploaded_a, file_name_a, preserve_format, max_file_size)
+                        _store_df("a", df_a)
+                        st.session_state["upload_token_a"] = upload_token_a
+                        st.session_state["_normalized_cols_a"] = set()
+                        # Los merges cacheados con la base anterior ya no se pueden reutilizar
+                        _cached_merge.clear()
+                    else:
+                        df_a = st.session_state["df_a"]
                     
                 preserve_status = "con formatos preservados" if preserve_format else "con tipos inferidos"
                 st.success(f"✅ {base_name_display_a} cargada: {len(df_a):,} filas × {len(df_a.columns)} columnas ({preserve_status})")
                 
-                # Mostrar información de calidad
-                quality_a = st.session_state["data_quality_a"]
-                with st.expander(f"📊 Análisis de calidad de {base_name_display_a}"):
+                # Analizar calidad de datos solo si el usuario lo pide
+                if st.checkbox(f"📊 Mostrar análisis de calidad de {base_name_display_a}", value=False, key="show_quality_a"):
+                    quality_a = _cached_quality(df_a, _df_token("a"))
+                    st.session_state["data_quality_a"] = quality_a
                     st.write(f"**Memoria:** {quality_a['memory_usage_mb']:.2f} MB")
                     st.write(f"**Columnas con nulos:**")
-                    null_cols = {k: f"{v:.1f}%" for k, v in quality_a['null_percentages'].items() if v > 0}
-                    if null_cols:
-                        st.json(null_cols)
+                    if quality_a.get("sampled"):
+                        st.caption(f"(aprox. sobre muestra de {QUALITY_SAMPLE_ROWS // 1000}k filas)")
+                    if quality_a["null_display"]:
+                        st.json(quality_a["null_display"])
                     else:
                         st.info("No hay columnas con valores nulos")
                 
                 st.write("**Vista previa (10 filas):**")
-                st.dataframe(df_a.head(10), use_container_width=True)
+                st.dataframe(_preview_arrow(df_a, _df_token("a"), 10), use_container_width=True)
                 
                 st.caption(f"Columnas disponibles ({len(df_a.columns)}):")
                 st.write(list(df_a.columns))
                 
                 # Detectar columnas clave automáticamente
-                detected_keys = detect_key_columns(df_a)
+                detected_keys = _cached_key_columns(df_a, _df_token("a"))
                 if detected_keys:
                     with st.expander("🔍 Columnas clave sugeridas"):
                         st.write("Columnas detectadas como posibles claves (ordenadas por probabilidad):")
@@ -183,6 +570,7 @@ with tab1:
                 base_name_a_error = st.session_state.get("base_name_a", "Base A")
                 st.error(f"❌ Error leyendo {base_name_a_error}: {e}")
                 st.session_state["df_a"] = None
+                st.session_state["upload_token_a"] = None
     
     with col_b:
         base_name_b_display = st.session_state.get("base_name_b", "Base B")
@@ -201,34 +589,42 @@ with tab1:
                 
                 with st.spinner(f"Cargando {base_name_display_b}..."):
                     preserve_format = st.session_state.get("preserve_format", True)
-                    df_b = load_file(uploaded_b, max_size_mb=max_file_size, preserve_format=preserve_format)
-                    st.session_state["df_b"] = df_b
-                    
-                    # Analizar calidad de datos
-                    st.session_state["data_quality_b"] = analyze_data_quality(df_b)
+                    # Solo volver a leer si cambió el archivo o las opciones de lectura
+                    upload_token_b = f"{uploaded_b.file_id}:{preserve_format}:{max_file_size}"
+                    if st.session_state.get("upload_token_b") != upload_token_b or st.session_state.get("df_b") is None:
+                        df_b = _load_upload("b", uploaded_b, file_name_b, preserve_format, max_file_size)
+                        _store_df("b", df_b)
+                        st.session_state["upload_token_b"] = upload_token_b
+                        st.session_state["_normalized_cols_b"] = set()
+                        # Los merges cacheados con la base anterior ya no se pueden reutilizar
+                        _cached_merge.clear()
+                    else:
+                        df_b = st.session_state["df_b"]
                     
                 preserve_status = "con formatos preservados" if preserve_format else "con tipos inferidos"
                 st.success(f"✅ {base_name_display_b} cargada: {len(df_b):,} filas × {len(df_b.columns)} columnas ({preserve_status})")
                 
-                # Mostrar información de calidad
-                quality_b = st.session_state["data_quality_b"]
-                with st.expander(f"📊 Análisis de calidad de {base_name_display_b}"):
+                # Analizar calidad de datos solo si el usuario lo pide
+                if st.checkbox(f"📊 Mostrar análisis de calidad de {base_name_display_b}", value=False, key="show_quality_b"):
+                    quality_b = _cached_quality(df_b, _df_token("b"))
+                    st.session_state["data_quality_b"] = quality_b
                     st.write(f"**Memoria:** {quality_b['memory_usage_mb']:.2f} MB")
                     st.write(f"**Columnas con nulos:**")
-                    null_cols = {k: f"{v:.1f}%" for k, v in quality_b['null_percentages'].items() if v > 0}
-                    if null_cols:
-                        st.json(null_cols)
+                    if quality_b.get("sampled"):
+                        st.caption(f"(aprox. sobre muestra de {QUALITY_SAMPLE_ROWS // 1000}k filas)")
+                    if quality_b["null_display"]:
+                        st.json(quality_b["null_display"])
                     else:
                         st.info("No hay columnas con valores nulos")
                 
                 st.write("**Vista previa (10 filas):**")
-                st.dataframe(df_b.head(10), use_container_width=True)
+                st.dataframe(_preview_arrow(df_b, _df_token("b"), 10), use_container_width=True)
                 
                 st.caption(f"Columnas disponibles ({len(df_b.columns)}):")
                 st.write(list(df_b.columns))
                 
                 # Detectar columnas clave automáticamente
-                detected_keys = detect_key_columns(df_b)
+                detected_keys = _cached_key_columns(df_b, _df_token("b"))
                 if detected_keys:
                     with st.expander("🔍 Columnas clave sugeridas"):
                         st.write("Columnas detectadas como posibles claves (ordenadas por probabilidad):")
@@ -239,6 +635,7 @@ with tab1:
                 base_name_b_error = st.session_state.get("base_name_b", "Base B")
                 st.error(f"❌ Error leyendo {base_name_b_error}: {e}")
                 st.session_state["df_b"] = None
+                st.session_state["upload_token_b"] = None
     
     # Comparación visual de las bases
     df_a = st.session_state.get("df_a")
@@ -259,26 +656,24 @@ with tab1:
             st.metric("Diferencia", f"{diff:,}")
         
         # Columnas comunes
-        common_cols = set(df_a.columns) & set(df_b.columns)
-        unique_a = set(df_a.columns) - set(df_b.columns)
-        unique_b = set(df_b.columns) - set(df_a.columns)
+        common_cols, unique_a, unique_b = _col_compare(tuple(df_a.columns), tuple(df_b.columns))
         
         comp_col4, comp_col5, comp_col6 = st.columns(3)
         with comp_col4:
             st.info(f"Columnas comunes: {len(common_cols)}")
             if len(common_cols) > 0:
                 with st.expander("Ver columnas comunes"):
-                    st.write(list(common_cols))
+                    st.write(common_cols)
         with comp_col5:
             st.warning(f"Solo en {base_name_a}: {len(unique_a)}")
             if len(unique_a) > 0:
                 with st.expander(f"Ver columnas únicas de {base_name_a}"):
-                    st.write(list(unique_a))
+                    st.write(unique_a)
         with comp_col6:
             st.warning(f"Solo en {base_name_b}: {len(unique_b)}")
             if len(unique_b) > 0:
                 with st.expander(f"Ver columnas únicas de {base_name_b}"):
-                    st.write(list(unique_b))
+                    st.write(unique_b)
 
 
 with tab2:
@@ -293,18 +688,22 @@ with tab2:
         base_name_a = st.session_state.get("base_name_a", "Base A")
         base_name_b = st.session_state.get("base_name_b", "Base B")
         
+        # Materializar las listas de columnas una sola vez por ejecución
+        cols_a_list = df_a.columns.tolist()
+        cols_b_list = df_b.columns.tolist()
+        
         # Normalización de datos
         if st.session_state.get("normalize_data", False):
             st.info("ℹ️ La normalización de datos está activada. Se eliminarán espacios en blanco.")
             normalize_cols_a = st.multiselect(
                 f"Columnas a normalizar en {base_name_a} (dejar vacío para todas)",
-                options=list(df_a.columns),
+                options=cols_a_list,
                 default=[],
                 key="norm_cols_a"
             )
             normalize_cols_b = st.multiselect(
                 f"Columnas a normalizar en {base_name_b} (dejar vacío para todas)",
-                options=list(df_b.columns),
+                options=cols_b_list,
                 default=[],
                 key="norm_cols_b"
             )
@@ -327,24 +726,24 @@ with tab2:
             if st.session_state.get("use_multiple_keys", False):
                 keys_a = st.multiselect(
                     f"Selecciona las columnas clave de {base_name_a}",
-                    options=list(df_a.columns),
+                    options=cols_a_list,
                     default=st.session_state.get("join_keys_a", []),
                     key="select_keys_a",
                 )
                 st.session_state["join_keys_a"] = keys_a
                 st.session_state["join_key_a"] = keys_a[0] if keys_a else None
             else:
-                detected = detect_key_columns(df_a)
+                detected = _cached_key_columns(df_a, _df_token("a"))
                 default_idx = 0
                 if detected and detected[0] in df_a.columns:
                     try:
-                        default_idx = list(df_a.columns).index(detected[0])
+                        default_idx = cols_a_list.index(detected[0])
                     except:
                         pass
                 
                 key_a = st.selectbox(
                     f"¿Cuál es la columna clave de {base_name_a}?",
-                    options=list(df_a.columns),
+                    options=cols_a_list,
                     index=default_idx,
                     key="select_key_a",
                     help="Selecciona la columna que identifica únicamente cada fila"
@@ -354,9 +753,10 @@ with tab2:
                 
                 # Mostrar información de la columna seleccionada
                 if key_a:
-                    unique_count = df_a[key_a].nunique()
-                    null_count = df_a[key_a].isna().sum()
-                    dup_count = df_a[key_a].duplicated().sum()
+                    key_stats_a = _key_stats(df_a, _df_token("a"), key_a)
+                    unique_count = key_stats_a["unique"]
+                    null_count = key_stats_a["null"]
+                    dup_count = key_stats_a["dup"]
                     
                     info_col1, info_col2, info_col3 = st.columns(3)
                     with info_col1:
@@ -375,24 +775,24 @@ with tab2:
             if st.session_state.get("use_multiple_keys", False):
                 keys_b = st.multiselect(
                     f"Selecciona las columnas clave de {base_name_b}",
-                    options=list(df_b.columns),
+                    options=cols_b_list,
                     default=st.session_state.get("join_keys_b", []),
                     key="select_keys_b",
                 )
                 st.session_state["join_keys_b"] = keys_b
                 st.session_state["join_key_b"] = keys_b[0] if keys_b else None
             else:
-                detected = detect_key_columns(df_b)
+                detected = _cached_key_columns(df_b, _df_token("b"))
                 default_idx = 0
                 if detected and detected[0] in df_b.columns:
                     try:
-                        default_idx = list(df_b.columns).index(detected[0])
+                        default_idx = cols_b_list.index(detected[0])
                     except:
                         pass
                 
                 key_b = st.selectbox(
                     f"¿Cuál es la columna clave de {base_name_b}?",
-                    options=list(df_b.columns),
+                    options=cols_b_list,
                     index=default_idx,
                     key="select_key_b",
                     help="Selecciona la columna que identifica únicamente cada fila"
@@ -402,9 +802,10 @@ with tab2:
                 
                 # Mostrar información de la columna seleccionada
                 if key_b:
-                    unique_count = df_b[key_b].nunique()
-                    null_count = df_b[key_b].isna().sum()
-                    dup_count = df_b[key_b].duplicated().sum()
+                    key_stats_b = _key_stats(df_b, _df_token("b"), key_b)
+                    unique_count = key_stats_b["unique"]
+                    null_count = key_stats_b["null"]
+                    dup_count = key_stats_b["dup"]
                     
                     info_col1, info_col2, info_col3 = st.columns(3)
                     with info_col1:
@@ -432,7 +833,10 @@ with tab2:
             validation_keys_b = keys_b if use_multiple_flag else [key_b]
             
             with st.spinner("Validando datos..."):
-                validation = validate_data_before_merge(df_a, df_b, validation_keys_a, validation_keys_b)
+                validation = _cached_validate(
+                    df_a, df_b, _df_token("a"), _df_token("b"),
+                    tuple(validation_keys_a), tuple(validation_keys_b),
+                )
                 st.session_state["validation_results"] = validation
             
             if validation["errors"]:
@@ -486,8 +890,8 @@ with tab2:
         st.divider()
         st.subheader("Paso 4: Seleccionar columnas a conservar")
         
-        cols_a_default = list(df_a.columns) if df_a is not None else []
-        cols_b_default = list(df_b.columns) if df_b is not None else []
+        cols_a_default = cols_a_list
+        cols_b_default = cols_b_list
         
         c1, c2 = st.columns(2)
         with c1:
@@ -497,7 +901,8 @@ with tab2:
                 saved_cols_a = []
             
             # Filtrar para mantener solo columnas que existen en las opciones actuales
-            valid_default_a = [col for col in saved_cols_a if col in cols_a_default]
+            cols_a_set = set(cols_a_default)
+            valid_default_a = [col for col in saved_cols_a if col in cols_a_set]
             # Si no hay valores válidos guardados, usar todas las columnas por defecto
             if not valid_default_a and cols_a_default:
                 valid_default_a = cols_a_default
@@ -518,7 +923,8 @@ with tab2:
                 saved_cols_b = []
             
             # Filtrar para mantener solo columnas que existen en las opciones actuales
-            valid_default_b = [col for col in saved_cols_b if col in cols_b_default]
+            cols_b_set = set(cols_b_default)
+            valid_default_b = [col for col in saved_cols_b if col in cols_b_set]
             # Si no hay valores válidos guardados, usar todas las columnas por defecto
             if not valid_default_b and cols_b_default:
                 valid_default_b = cols_b_default
@@ -561,18 +967,8 @@ with tab3:
                 norm_cols_b = st.session_state.get("normalize_columns_b", [])
                 
                 with st.spinner("Normalizando datos..."):
-                    if norm_cols_a:
-                        df_a = normalize_data(df_a, norm_cols_a)
-                    else:
-                        df_a = normalize_data(df_a)
-                    
-                    if norm_cols_b:
-                        df_b = normalize_data(df_b, norm_cols_b)
-                    else:
-                        df_b = normalize_data(df_b)
-                
-                st.session_state["df_a"] = df_a
-                st.session_state["df_b"] = df_b
+                    df_a = _normalize_once("a", df_a, norm_cols_a)
+                    df_b = _normalize_once("b", df_b, norm_cols_b)
             
             use_multiple_flag = st.session_state.get("use_multiple_keys", False)
             keys_a = st.session_state.get("join_keys_a", [])
@@ -605,60 +1001,29 @@ with tab3:
                 
                 try:
                     with st.spinner("Procesando merge..."):
-                        if how in {"inner", "left", "right", "outer"}:
-                            merged = do_merge(df_a, df_b, merge_keys_a, merge_keys_b, how=how, suffixes=suffixes)
-                            filtered = filter_columns(
-                                merged,
-                                cols_from_a=cols_from_a,
-                                cols_from_b=cols_from_b,
-                                key_a=merge_keys_a[0] if isinstance(merge_keys_a, list) else merge_keys_a,
-                                key_b=merge_keys_b[0] if isinstance(merge_keys_b, list) else merge_keys_b,
-                                suffixes=suffixes,
-                            )
-                            # Corregir columnas duplicadas si existen
-                            filtered = fix_duplicate_columns(filtered)
-                            st.session_state["resultado"] = filtered
-                            stats = build_summary_stats(
-                                df_a, df_b,
-                                merge_keys_a[0] if isinstance(merge_keys_a, list) else merge_keys_a,
-                                merge_keys_b[0] if isinstance(merge_keys_b, list) else merge_keys_b,
-                                how, filtered
-                            )
-                            st.session_state["stats"] = stats
-                        elif how == "anti A vs B":
-                            result = anti_join(df_a, df_b, merge_keys_a, merge_keys_b, direction="A_not_in_B")
-                            filtered = result.loc[:, [c for c in cols_from_a if c in result.columns]]
-                            # Corregir columnas duplicadas si existen
-                            filtered = fix_duplicate_columns(filtered)
-                            st.session_state["resultado"] = filtered
-                            stats = build_summary_stats(
-                                df_a, df_b,
-                                merge_keys_a[0] if isinstance(merge_keys_a, list) else merge_keys_a,
-                                merge_keys_b[0] if isinstance(merge_keys_b, list) else merge_keys_b,
-                                "anti_A_vs_B", filtered
-                            )
-                            st.session_state["stats"] = stats
-                        elif how == "anti B vs A":
-                            result = anti_join(df_a, df_b, merge_keys_a, merge_keys_b, direction="B_not_in_A")
-                            filtered = result.loc[:, [c for c in cols_from_b if c in result.columns]]
-                            # Corregir columnas duplicadas si existen
-                            filtered = fix_duplicate_columns(filtered)
-                            st.session_state["resultado"] = filtered
-                            stats = build_summary_stats(
-                                df_a, df_b,
-                                merge_keys_a[0] if isinstance(merge_keys_a, list) else merge_keys_a,
-                                merge_keys_b[0] if isinstance(merge_keys_b, list) else merge_keys_b,
-                                "anti_B_vs_A", filtered
-                            )
-                            st.session_state["stats"] = stats
+                        merge_args = (
+                            df_a, df_b, _df_token("a"), _df_token("b"),
+                            merge_keys_a, merge_keys_b, how, suffixes, cols_from_a, cols_from_b,
+                        )
+                        try:
+                            path, stats = _cached_merge(*merge_args)
+                            if not os.path.exists(path):
+                                # El Parquet cacheado se eliminó al liberar espacio: recalcular esa entrada
+                                _cached_merge.clear(*merge_args)
+                                path, stats = _cached_merge(*merge_args)
+                            _stash("resultado", path)
+                        except _UnspilledResult as unspilled:
+                            stats = unspilled.stats
+                            _stash("resultado", None, unspilled.df)
+                        st.session_state["stats"] = stats
                     
                     # Guardar en historial
                     history_entry = {
-                        "timestamp": pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S"),
+                        "timestamp": datetime.now().isoformat(sep=" ", timespec="seconds"),
                         "join_type": how,
                         "keys_a": merge_keys_a,
                         "keys_b": merge_keys_b,
-                        "rows_result": len(st.session_state["resultado"]),
+                        "rows_result": stats["rows_result"],
                     }
                     st.session_state["merge_history"].append(history_entry)
                     
@@ -671,7 +1036,8 @@ with tab3:
                         st.code(traceback.format_exc())
     
     # Mostrar resultado
-    if st.session_state.get("resultado") is not None:
+    df_result = _unstash("resultado")
+    if df_result is not None:
         base_name_a = st.session_state.get("base_name_a", "Base A")
         base_name_b = st.session_state.get("base_name_b", "Base B")
         join_type = st.session_state.get("join_type", "inner")
@@ -697,69 +1063,34 @@ with tab3:
         st.divider()
         st.subheader("🔍 Vista Previa y Búsqueda")
         
-        df_result = st.session_state["resultado"]
-        
-        # Búsqueda y filtrado
-        search_col1, search_col2 = st.columns([2, 1])
-        with search_col1:
-            search_term = st.text_input("🔍 Buscar en los datos", key="search_term")
-        with search_col2:
-            max_rows_preview = st.number_input("Filas a mostrar", min_value=10, max_value=1000, value=50, step=10)
-        
-        # Filtrar por término de búsqueda
-        df_display = df_result.copy()
-        if search_term:
-            # Buscar en todas las columnas de tipo string
-            mask = pd.Series([False] * len(df_display))
-            for col in df_display.columns:
-                if df_display[col].dtype == 'object':
-                    mask = mask | df_display[col].astype(str).str.contains(search_term, case=False, na=False)
-            df_display = df_display[mask]
-            st.info(f"Mostrando {len(df_display):,} filas que coinciden con '{search_term}'")
-        
-        # Verificar y corregir columnas duplicadas antes de mostrar
-        if df_display.columns.duplicated().any():
-            st.warning("⚠️ Se detectaron columnas con nombres duplicados. Se renombrarán automáticamente para la visualización.")
-            df_display = fix_duplicate_columns(df_display)
-        
-        st.write(f"**Total de filas:** {len(df_result):,}")
-        if len(df_display) > 0:
-            st.dataframe(df_display.head(max_rows_preview), use_container_width=True)
-        else:
-            st.warning("No hay resultados que coincidan con la búsqueda")
+        _preview_fragment(df_result)
         
         st.divider()
         st.subheader("💾 Descargar Resultado")
         
-        download_col1, download_col2 = st.columns(2)
+        # Para resultados grandes Excel es lento: ofrecer también Feather (Arrow comprimido)
+        offer_feather = len(df_result) > FEATHER_MIN_ROWS
+        if offer_feather:
+            download_col1, download_col2, download_col3 = st.columns(3)
+        else:
+            download_col1, download_col2 = st.columns(2)
         
         with download_col1:
-            try:
-                excel_bytes = to_excel_bytes(df_result)
-                filename = sanitize_filename("resultado_merge.xlsx")
-                st.download_button(
-                    label="📥 Descargar Excel",
-                    data=excel_bytes,
-                    file_name=filename,
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    use_container_width=True,
-                )
-            except Exception as e:
-                st.error(f"No se pudo preparar el archivo Excel: {e}")
+            _download_slot(
+                df_result, "excel", _cached_excel, "Excel", "resultado_merge.xlsx",
+                "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            )
         
         with download_col2:
-            try:
-                csv_bytes = to_csv_bytes(df_result)
-                filename = sanitize_filename("resultado_merge.csv")
-                st.download_button(
-                    label="📥 Descargar CSV",
-                    data=csv_bytes,
-                    file_name=filename,
-                    mime="text/csv",
-                    use_container_width=True,
+            _download_slot(df_result, "csv", _cached_csv, "CSV", "resultado_merge.csv", "text/csv")
+        
+        if offer_feather:
+            with download_col3:
+                _download_slot(
+                    df_result, "feather", _cached_feather, "Feather", "resultado_merge.feather",
+                    "application/vnd.apache.arrow.file",
+                    help="Formato columnar comprimido, mucho más rápido que Excel para bases grandes (se abre con pandas, Polars o R)",
                 )
-            except Exception as e:
-                st.error(f"No se pudo preparar el archivo CSV: {e}")
     else:
         st.info("💡 Ve a la pestaña 'Configurar Merge' y genera un resultado para verlo aquí.")
 
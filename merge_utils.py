@@ -1,38 +1,108 @@
 from __future__ import annotations
 
+import csv
 import logging
+import os
 import re
-from io import BytesIO
-from typing import Any, Dict, Iterable, List, Literal, Optional, Tuple, Union
+from functools import lru_cache
+from io import BytesIO, TextIOWrapper
+from typing import Any, Dict, Iterable, List, Literal, NamedTuple, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.feather as pa_feather
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Copy-on-Write: selections share memory with their source until one of them is modified,
+# so results returned here are not copied defensively
+pd.options.mode.copy_on_write = True
+
 
 def validate_file_size(uploaded_file, max_size_mb: int = 100) -> bool:
     """Validate file size doesn't exceed maximum."""
     if uploaded_file is None:
         return False
-    size_bytes = uploaded_file.size
+    if isinstance(uploaded_file, (str, os.PathLike)):
+        size_bytes = os.path.getsize(uploaded_file)
+    else:
+        size_bytes = getattr(uploaded_file, "size", None)
+    if size_bytes is None:
+        # Plain BytesIO buffers have no .size attribute
+        size_bytes = uploaded_file.getbuffer().nbytes
     size_mb = size_bytes / (1024 * 1024)
     if size_mb > max_size_mb:
         raise ValueError(f"El archivo es demasiado grande ({size_mb:.2f} MB). Máximo permitido: {max_size_mb} MB")
     return True
 
 
+def _read_csv_header(source) -> List[str]:
+    """Return the column names of a CSV file without consuming the source."""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, encoding="utf-8-sig", newline="") as f:
+            return next(csv.reader(f), [])
+    position = source.tell()
+    text = TextIOWrapper(source, encoding="utf-8-sig", newline="")
+    try:
+        return next(csv.reader(text), [])
+    finally:
+        text.detach()
+        source.seek(position)
+
+
+def _read_csv_pyarrow(source) -> pd.DataFrame:
+    """
+    Read a CSV as text with pyarrow's multi-threaded parser.
+
+    Every column is kept as text and only empty strings become nulls; columns are
+    Arrow-backed strings (pd.ArrowDtype). Type inference is left to pandas.read_csv:
+    pyarrow's differs (integers beyond int64 become float, all-empty columns have
+    no type) and its peak memory is about twice that of pandas' parser.
+    """
+    header = _read_csv_header(source)
+    if not header or len(set(header)) != len(header) or not all(header):
+        # pandas renames empty/duplicated headers ("Unnamed: 0", "col.1"); keep its behaviour
+        raise ValueError("Encabezado no soportado por el lector de pyarrow")
+    convert_options = pa_csv.ConvertOptions(
+        column_types={col: pa.string() for col in header},
+        strings_can_be_null=True,
+        null_values=[""],
+    )
+    table = pa_csv.read_csv(source, convert_options=convert_options)
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+@lru_cache(maxsize=None)
+def _excel_engine() -> Optional[str]:
+    """'calamine' if python-calamine is installed, else None (pandas' default engine). Checked once."""
+    try:
+        import python_calamine  # noqa: F401
+    except ImportError:
+        return None
+    return "calamine"
+
+
+def _read_excel(source, **kwargs) -> pd.DataFrame:
+    """Read an Excel file with the Rust calamine engine, falling back to pandas' default engine."""
+    # Sin python-calamine: openpyxl (.xlsx) / xlrd (.xls), importados por pandas solo al leer
+    return pd.read_excel(source, engine=_excel_engine(), **kwargs)
+
+
 def load_file(uploaded_file, max_size_mb: int = 100, preserve_format: bool = False) -> pd.DataFrame:
     """
-    Load a CSV or Excel file-like object into a pandas DataFrame.
+    Load a CSV or Excel file (file-like object or path) into a pandas DataFrame.
 
     - Supports .csv and .xlsx (by extension).
-    - Tries to infer encoding for CSV using pandas defaults.
+    - Parses CSV (UTF-8) with pandas; text-only reads (preserve_format) use pyarrow.
     - Validates file size.
     
     Args:
-        uploaded_file: File-like object to read
+        uploaded_file: File-like object or filesystem path to read
         max_size_mb: Maximum file size in MB
         preserve_format: If True, reads all columns as text to preserve original formats.
                         If False, pandas will infer data types automatically.
@@ -44,37 +114,45 @@ def load_file(uploaded_file, max_size_mb: int = 100, preserve_format: bool = Fal
     validate_file_size(uploaded_file, max_size_mb)
     
     # Validar extensión
-    name = getattr(uploaded_file, "name", "").lower()
+    if isinstance(uploaded_file, (str, os.PathLike)):
+        name = os.fspath(uploaded_file).lower()
+    else:
+        name = getattr(uploaded_file, "name", "").lower()
     if not (name.endswith((".csv", ".xlsx", ".xls"))):
         raise ValueError("El archivo debe ser CSV o Excel (.csv, .xlsx, .xls)")
 
     try:
         if name.endswith(".csv"):
             if preserve_format:
-                # Leer todo como texto para preservar formatos
-                df = pd.read_csv(
-                    uploaded_file, 
-                    encoding='utf-8',
-                    dtype=str,
-                    keep_default_na=False  # No convertir strings vacíos a NaN
-                )
-                # Convertir strings vacíos a NaN después de leer
-                df = df.replace('', pd.NA)
+                try:
+                    # Leer todo como texto con pyarrow (strings vacíos -> nulos al parsear)
+                    df = _read_csv_pyarrow(uploaded_file)
+                except (pa.ArrowException, ValueError) as e:
+                    logger.info(f"Lector pyarrow no disponible para este CSV ({e}), usando pandas")
+                    if not isinstance(uploaded_file, (str, os.PathLike)):
+                        uploaded_file.seek(0)
+                    # Leer todo como texto para preservar formatos
+                    df = pd.read_csv(
+                        uploaded_file, 
+                        encoding='utf-8',
+                        dtype=str,
+                        keep_default_na=False  # No convertir strings vacíos a NaN
+                    )
+                    # Convertir strings vacíos a NaN después de leer
+                    df = df.replace('', pd.NA)
             else:
                 df = pd.read_csv(uploaded_file, encoding='utf-8')
         elif name.endswith((".xlsx", ".xls")):
             if preserve_format:
-                # Para Excel, leer todo como texto
-                df = pd.read_excel(
+                # Para Excel, leer todo como texto (las celdas vacías ya llegan como NaN)
+                df = _read_excel(
                     uploaded_file,
                     dtype=str,
                     na_values=[''],  # Tratar strings vacíos como NaN
                     keep_default_na=False
                 )
-                # Convertir strings vacíos a NaN después de leer
-                df = df.replace('', pd.NA)
             else:
-                df = pd.read_excel(uploaded_file)
+                df = _read_excel(uploaded_file)
         else:
             # Fallback: try CSV first, then Excel
             uploaded_file.seek(0)
@@ -92,14 +170,14 @@ def load_file(uploaded_file, max_size_mb: int = 100, preserve_format: bool = Fal
             except Exception:
                 uploaded_file.seek(0)
                 if preserve_format:
-                    df = pd.read_excel(
+                    df = _read_excel(
                         uploaded_file,
                         dtype=str,
                         keep_default_na=False
                     )
                     df = df.replace('', pd.NA)
                 else:
-                    df = pd.read_excel(uploaded_file)
+                    df = _read_excel(uploaded_file)
         
         logger.info(f"Archivo cargado: {len(df)} filas, {len(df.columns)} columnas (preserve_format={preserve_format})")
         return df
@@ -136,6 +214,8 @@ def do_merge(
     left_key = key_a if len(key_a) > 1 else key_a[0]
     right_key = key_b if len(key_b) > 1 else key_b[0]
     
+    # Text keys are joined as they are: casting both sides to a shared categorical
+    # costs more (union of the categories) than the hash join saves.
     merged = pd.merge(
         df_a,
         df_b,
@@ -143,21 +223,120 @@ def do_merge(
         right_on=right_key,
         how=how,
         suffixes=suffixes,
+        sort=False,
     )
     logger.info(f"Merge completado: {len(merged)} filas resultado")
     return merged
 
 
+def prune_merge_inputs(
+    df_a: pd.DataFrame,
+    df_b: pd.DataFrame,
+    key_a: Union[str, List[str]],
+    key_b: Union[str, List[str]],
+    cols_from_a: Optional[List[str]],
+    cols_from_b: Optional[List[str]],
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Drop the columns a merge + filter_columns would discard before merging.
+
+    Keys, selected columns and any column whose name exists on both sides are kept,
+    so pandas assigns exactly the same suffixes as with the full frames. If no
+    selected column exists (filter_columns would then keep everything), the inputs
+    are returned unchanged.
+    """
+    keys_a = [key_a] if isinstance(key_a, str) else list(key_a)
+    keys_b = [key_b] if isinstance(key_b, str) else list(key_b)
+    selected_a = df_a.columns.intersection(pd.Index(cols_from_a or []), sort=False)
+    selected_b = df_b.columns.intersection(pd.Index(cols_from_b or []), sort=False)
+    if len(selected_a) == 0 and len(selected_b) == 0:
+        return df_a, df_b
+
+    shared = df_a.columns.intersection(df_b.columns, sort=False)
+    keep_a = df_a.columns.isin(selected_a.union(shared, sort=False).union(pd.Index(keys_a), sort=False))
+    keep_b = df_b.columns.isin(selected_b.union(shared, sort=False).union(pd.Index(keys_b), sort=False))
+    return df_a.loc[:, keep_a], df_b.loc[:, keep_b]
+
+
+class KeyCodes(NamedTuple):
+    """Integer codes of the keys of A and B against one shared dictionary (-1 = null)."""
+
+    codes_a: np.ndarray
+    codes_b: np.ndarray
+    n_keys: int
+
+
+def _encode_column_pair(left: pd.Series, right: pd.Series) -> KeyCodes:
+    # Empty sides are left out so they do not change the concatenated dtype
+    parts = [s for s in (left, right) if len(s)] or [left]
+    codes, uniques = pd.factorize(pd.concat(parts, ignore_index=True), use_na_sentinel=True)
+    return KeyCodes(codes[:len(left)], codes[len(left):], len(uniques))
+
+
+def encode_keys(
+    df_a: pd.DataFrame,
+    df_b: pd.DataFrame,
+    key_a: Union[str, List[str]],
+    key_b: Union[str, List[str]],
+) -> KeyCodes:
+    """
+    Encode the key columns of A and B once, so anti_join and build_summary_stats
+    can share the result instead of hashing the keys again.
+
+    Composite keys are encoded column by column and the codes are combined into one
+    integer per row; a row with a null in any key column gets -1.
+    """
+    if isinstance(key_a, str):
+        key_a = [key_a]
+    if isinstance(key_b, str):
+        key_b = [key_b]
+    if len(key_a) == 1:
+        return _encode_column_pair(df_a[key_a[0]], df_b[key_b[0]])
+
+    codes_a = np.zeros(len(df_a), dtype=np.int64)
+    codes_b = np.zeros(len(df_b), dtype=np.int64)
+    null_a = np.zeros(len(df_a), dtype=bool)
+    null_b = np.zeros(len(df_b), dtype=bool)
+    n_keys = 1
+    for col_a, col_b in zip(key_a, key_b):
+        pair = _encode_column_pair(df_a[col_a], df_b[col_b])
+        null_a |= pair.codes_a < 0
+        null_b |= pair.codes_b < 0
+        # Mixed-radix combination, re-factorized each step so the codes stay dense
+        combined = np.concatenate([
+            codes_a * pair.n_keys + np.maximum(pair.codes_a, 0),
+            codes_b * pair.n_keys + np.maximum(pair.codes_b, 0),
+        ])
+        codes, uniques = pd.factorize(combined)
+        codes_a, codes_b = codes[:len(df_a)], codes[len(df_a):]
+        n_keys = len(uniques)
+    codes_a[null_a] = -1
+    codes_b[null_b] = -1
+    return KeyCodes(codes_a, codes_b, n_keys)
+
+
+def _rows_with_match(codes: np.ndarray, other_codes: np.ndarray, n_keys: int) -> np.ndarray:
+    """Boolean mask of the rows whose code also appears in other_codes (nulls never match)."""
+    present = np.zeros(n_keys, dtype=bool)
+    present[other_codes[other_codes >= 0]] = True
+    matched = np.zeros(len(codes), dtype=bool)
+    valid = codes >= 0
+    matched[valid] = present[codes[valid]]
+    return matched
+
+
 def anti_join(
     df_a: pd.DataFrame,
     df_b: pd.DataFrame,
     key_a: Union[str, List[str]],
     key_b: Union[str, List[str]],
     direction: Literal["A_not_in_B", "B_not_in_A"] = "A_not_in_B",
+    key_codes: Optional[KeyCodes] = None,
 ) -> pd.DataFrame:
     """
     Return rows in A not present in B (or vice versa) by the selected keys.
-    Supports single or multiple keys.
+    Supports single or multiple keys. key_codes from encode_keys can be
+    passed to reuse an existing encoding.
     """
     # Convert to list if single key
     if isinstance(key_a, str):
@@ -168,28 +347,27 @@ def anti_join(
     if len(key_a) != len(key_b):
         raise ValueError("key_a y key_b deben tener el mismo número de columnas")
     
-    if direction == "A_not_in_B":
-        # Create a set of tuples from B for efficient lookup
-        if len(key_b) == 1:
-            b_keys = set(df_b[key_b[0]].dropna().unique())
-            mask = ~df_a[key_a[0]].isin(b_keys)
-        else:
-            # Multiple keys: create set of tuples
-            b_keys = set(df_b[key_b].dropna().apply(tuple, axis=1).unique())
-            mask = ~df_a[key_a].apply(tuple, axis=1).isin(b_keys)
-        return df_a.loc[mask].copy()
-    elif direction == "B_not_in_A":
-        # Create a set of tuples from A for efficient lookup
-        if len(key_a) == 1:
-            a_keys = set(df_a[key_a[0]].dropna().unique())
-            mask = ~df_b[key_b[0]].isin(a_keys)
-        else:
-            # Multiple keys: create set of tuples
-            a_keys = set(df_a[key_a].dropna().apply(tuple, axis=1).unique())
-            mask = ~df_b[key_b].apply(tuple, axis=1).isin(a_keys)
-        return df_b.loc[mask].copy()
-    else:
+    if direction not in ("A_not_in_B", "B_not_in_A"):
         raise ValueError("direction must be 'A_not_in_B' or 'B_not_in_A'")
+    
+    if key_codes is None and len(key_a) == 1:
+        # Single key with no encoding to reuse: one isin against the other column
+        # (null keys never match, as in the encoded path)
+        left, right = (df_a, df_b) if direction == "A_not_in_B" else (df_b, df_a)
+        left_key, right_key = (key_a[0], key_b[0]) if direction == "A_not_in_B" else (key_b[0], key_a[0])
+        keys = left[left_key]
+        return left.loc[~(keys.isin(right[right_key]) & keys.notna())]
+
+    # Shared integer encoding of the keys (single or composite): membership without rehashing.
+    # A left merge with indicator=True would be slower, renumber the rows and match null keys.
+    if key_codes is None:
+        key_codes = encode_keys(df_a, df_b, key_a, key_b)
+    if direction == "A_not_in_B":
+        mask = ~_rows_with_match(key_codes.codes_a, key_codes.codes_b, key_codes.n_keys)
+        return df_a.loc[mask]
+    mask = ~_rows_with_match(key_codes.codes_b, key_codes.codes_a, key_codes.n_keys)
+    return df_b.loc[mask]
+
 
 
 def _with_suffix(column: str, suffix: str) -> str:
@@ -220,14 +398,16 @@ def filter_columns(
     suffix_a, suffix_b = suffixes
 
     selected_cols: List[str] = []
+    # Built once: every lookup below is a constant-time set membership
+    merged_cols = set(df_merged.columns)
 
     def resolve(col: str, prefer_suffix: str) -> Optional[str]:
         # If already present as-is
-        if col in df_merged.columns:
+        if col in merged_cols:
             return col
         # Try with suffix
         candidate = _with_suffix(col, prefer_suffix)
-        if candidate in df_merged.columns:
+        if candidate in merged_cols:
             return candidate
         return None
 
@@ -244,20 +424,29 @@ def filter_columns(
             selected_cols.append(resolved)
 
     # Include keys when explicitly part of selections
+    selected_set = set(selected_cols)
     if key_a and key_a in cols_from_a:
         k = resolve(key_a, suffix_a)
-        if k and k not in selected_cols:
+        if k and k not in selected_set:
             selected_cols.append(k)
+            selected_set.add(k)
     if key_b and key_b in cols_from_b:
         k = resolve(key_b, suffix_b)
-        if k and k not in selected_cols:
+        if k and k not in selected_set:
             selected_cols.append(k)
 
     # Fallback: if nothing selected, keep all
     if not selected_cols:
         return df_merged
 
-    return df_merged.loc[:, [c for c in selected_cols if c in df_merged.columns]].copy()
+    # Every selected column was resolved against merged_cols, so no re-check is needed.
+    # .loc (not reindex) keeps working when the merge produced repeated column names.
+    return df_merged.loc[:, selected_cols]
+
+
+def _is_plain_numeric(series: pd.Series) -> bool:
+    """True for NumPy integer/float columns (not object, extension, bool or dates)."""
+    return isinstance(series.dtype, np.dtype) and series.dtype.kind in "iuf"
 
 
 def build_summary_stats(
@@ -274,29 +463,45 @@ def build_summary_stats(
         "anti_B_vs_A",
     ],
     result_df: pd.DataFrame,
+    key_codes: Optional[KeyCodes] = None,
 ) -> Dict[str, int]:
     """
     Build a dictionary of metrics for reporting.
 
     - Keys matched are counted at the key level (unique keys), not row-level.
     - For anti joins, report excluded rows as the count of rows in the excluded side.
+    - key_codes (from encode_keys) avoids encoding the keys again.
     """
     rows_a = int(len(df_a))
     rows_b = int(len(df_b))
     rows_result = int(len(result_df))
 
-    unique_keys_a = int(df_a[key_a].dropna().nunique())
-    unique_keys_b = int(df_b[key_b].dropna().nunique())
-
-    set_a = set(df_a[key_a].dropna().unique())
-    set_b = set(df_b[key_b].dropna().unique())
-    keys_intersection = len(set_a & set_b)
-
     excluded_rows = 0
-    if how == "anti_A_vs_B":
-        excluded_rows = int((~df_a[key_a].isin(df_b[key_b])).sum())
-    elif how == "anti_B_vs_A":
-        excluded_rows = int((~df_b[key_b].isin(df_a[key_a])).sum())
+    if key_codes is None and how not in ("anti_A_vs_B", "anti_B_vs_A") and _is_plain_numeric(
+        df_a[key_a]
+    ) and _is_plain_numeric(df_b[key_b]):
+        # Numeric keys: sorted intersection of the uniques in NumPy, no per-row codes needed
+        uniques_a = df_a[key_a].dropna().unique()
+        uniques_b = df_b[key_b].dropna().unique()
+        unique_keys_a = len(uniques_a)
+        unique_keys_b = len(uniques_b)
+        keys_intersection = int(np.intersect1d(uniques_a, uniques_b, assume_unique=True).size)
+    else:
+        # One shared factorize pass over both keys; every metric comes from the codes
+        if key_codes is None:
+            key_codes = encode_keys(df_a, df_b, key_a, key_b)
+        codes_a, codes_b, n_keys = key_codes
+        counts_a = np.bincount(codes_a[codes_a >= 0], minlength=n_keys)
+        counts_b = np.bincount(codes_b[codes_b >= 0], minlength=n_keys)
+        unique_keys_a = int((counts_a > 0).sum())
+        unique_keys_b = int((counts_b > 0).sum())
+        keys_intersection = int(((counts_a > 0) & (counts_b > 0)).sum())
+
+        if how == "anti_A_vs_B":
+            # Null keys never match, so they always count as excluded
+            excluded_rows = int(len(codes_a) - counts_a[counts_b > 0].sum())
+        elif how == "anti_B_vs_A":
+            excluded_rows = int(len(codes_b) - counts_b[counts_a > 0].sum())
 
     return {
         "rows_a": rows_a,
@@ -312,25 +517,79 @@ def build_summary_stats(
 def to_excel_bytes(df: pd.DataFrame) -> bytes:
     """Return the Excel bytes for the given DataFrame (in-memory)."""
     buffer = BytesIO()
-    # Use openpyxl engine
-    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+    # xlsxwriter emits the sheet XML much faster than openpyxl. Its constant_memory
+    # mode is not used: pandas writes cell by cell in column order, which that mode drops.
+    # strings_to_urls=False: text is written as-is, without scanning each cell for URLs
+    # (which would also turn them into hyperlinks and hit Excel's 65,530 links limit).
+    with pd.ExcelWriter(
+        buffer, engine="xlsxwriter", engine_kwargs={"options": {"strings_to_urls": False}}
+    ) as writer:
         df.to_excel(writer, index=False)
     buffer.seek(0)
     return buffer.read()
 
 
-def to_csv_bytes(df: pd.DataFrame) -> bytes:
-    """Return the CSV bytes for the given DataFrame (in-memory)."""
+def _to_csv_bytes_pandas(df: pd.DataFrame) -> bytes:
+    """Return the CSV bytes for the given DataFrame using pandas.to_csv (in-memory)."""
     buffer = BytesIO()
     df.to_csv(buffer, index=False, encoding='utf-8')
     buffer.seek(0)
     return buffer.read()
 
 
+def _arrow_csv_compatible(series: pd.Series) -> bool:
+    """True if pyarrow writes this column exactly as pandas.to_csv would (text or integers)."""
+    if series.dtype == object:
+        return pd.api.types.infer_dtype(series, skipna=True) in ("string", "empty")
+    return pd.api.types.is_string_dtype(series.dtype) or pd.api.types.is_integer_dtype(series.dtype)
+
+
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """
+    Return the CSV bytes for the given DataFrame (in-memory).
+
+    Text and integer columns are written with pyarrow's C++ CSV writer; frames
+    with floats, booleans or dates keep pandas' formatting. Text values are
+    always quoted by pyarrow, which CSV readers parse to the same values.
+    A row with every field null would be an empty line for pyarrow (readers skip
+    it), which only happens with a single column; those frames also use pandas,
+    which writes "" instead.
+    """
+    if not all(_arrow_csv_compatible(df.iloc[:, i]) for i in range(df.shape[1])):
+        return _to_csv_bytes_pandas(df)
+    if df.shape[1] == 1 and df.iloc[:, 0].isna().any():
+        return _to_csv_bytes_pandas(df)
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowException, ValueError):
+        return _to_csv_bytes_pandas(df)
+
+    buffer = BytesIO()
+    # Header written like pandas (quoted only when needed)
+    header = TextIOWrapper(buffer, encoding="utf-8", newline="")
+    csv.writer(header, lineterminator="\n").writerow(df.columns)
+    header.detach()
+    write_options = pa_csv.WriteOptions(include_header=False, quoting_style="needed")
+    pa_csv.write_csv(table, buffer, write_options=write_options)
+    return buffer.getvalue()
+
+
+def to_feather_bytes(df: pd.DataFrame) -> bytes:
+    """Return zstd-compressed Feather (Arrow IPC) bytes for the given DataFrame."""
+    buffer = BytesIO()
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pa_feather.write_feather(table, buffer, compression="zstd")
+    return buffer.getvalue()
+
+
+# Characters not allowed in file names (Windows and POSIX)
+_SANITIZE_RE = re.compile(r'[<>:"/\\|?*]')
+
+
 def sanitize_filename(filename: str) -> str:
     """Sanitize filename to remove invalid characters."""
     # Remove invalid characters
-    filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
+    filename = _SANITIZE_RE.sub('_', filename)
     # Remove leading/trailing spaces and dots
     filename = filename.strip(' .')
     # Limit length
@@ -365,47 +624,72 @@ def extract_base_name(filename: str) -> str:
     return base
 
 
+# Common key column names (case insensitive), fused into one pattern compiled once
+_KEY_PATTERNS = [
+    r'^id$', r'^id_', r'_id$', r'^codigo', r'^cod', r'^key', r'_key$',
+    r'^email', r'^mail', r'^dni', r'^nif', r'^cedula', r'^passport',
+    r'^sku', r'^producto_id', r'^cliente_id', r'^usuario_id'
+]
+_KEY_RE = re.compile("|".join(_KEY_PATTERNS))
+
+
 def detect_key_columns(df: pd.DataFrame) -> List[str]:
     """
     Detect potential key columns by looking for common patterns.
     Returns list of column names sorted by likelihood of being a key.
     """
-    candidates = []
+    n_rows = len(df)
     
-    # Common key column names (case insensitive)
-    key_patterns = [
-        r'^id$', r'^id_', r'_id$', r'^codigo', r'^cod', r'^key', r'_key$',
-        r'^email', r'^mail', r'^dni', r'^nif', r'^cedula', r'^passport',
-        r'^sku', r'^producto_id', r'^cliente_id', r'^usuario_id'
-    ]
+    # Uniqueness and nulls for all columns in one vectorized pass each
+    if n_rows > 0:
+        unique_ratios = df.nunique().to_numpy() / n_rows
+        null_ratios = df.isna().sum().to_numpy() / n_rows
+    else:
+        unique_ratios = np.zeros(len(df.columns))
+        null_ratios = np.ones(len(df.columns))
     
-    for col in df.columns:
-        col_lower = str(col).lower()
-        score = 0
-        
-        # Check for key patterns
-        for pattern in key_patterns:
-            if re.search(pattern, col_lower):
-                score += 10
-                break
-        
-        # Prefer columns with high uniqueness
-        unique_ratio = df[col].nunique() / len(df) if len(df) > 0 else 0
-        if unique_ratio > 0.9:  # High uniqueness
-            score += 5
-        elif unique_ratio > 0.7:
-            score += 2
-        
-        # Prefer non-null columns
-        null_ratio = df[col].isna().sum() / len(df) if len(df) > 0 else 1
-        if null_ratio < 0.1:  # Low null ratio
-            score += 3
-        
-        candidates.append((col, score))
+    # Check for key patterns
+    scores = np.array([10 if _KEY_RE.search(str(col).lower()) else 0 for col in df.columns], dtype=np.int64)
+    
+    # Prefer columns with high uniqueness
+    scores += np.where(unique_ratios > 0.9, 5, np.where(unique_ratios > 0.7, 2, 0))
     
-    # Sort by score descending
-    candidates.sort(key=lambda x: x[1], reverse=True)
-    return [col for col, score in candidates if score > 0]
+    # Prefer non-null columns
+    scores += np.where(null_ratios < 0.1, 3, 0)
+    
+    # Sort by score descending (stable: ties keep the column order)
+    order = np.argsort(-scores, kind="stable")
+    return [df.columns[i] for i in order if scores[i] > 0]
+
+
+def key_column_stats(series: pd.Series) -> Dict[str, int]:
+    """
+    Return unique, null and duplicate counts of a key column from a single factorize pass.
+
+    Matches nunique(), isna().sum() and duplicated().sum() (repeated nulls count as duplicates).
+    """
+    return _key_column_profile(series)[0]
+
+
+def _key_column_profile(series: pd.Series) -> Tuple[Dict[str, int], pd.Index]:
+    """key_column_stats plus the distinct non-null values, from the same factorize pass."""
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    null_count = int((codes == -1).sum())
+    unique_count = len(uniques)
+    dup_count = len(codes) - unique_count - (1 if null_count else 0)
+    return {"unique": unique_count, "null": null_count, "dup": dup_count}, pd.Index(uniques)
+
+
+def _composite_keys(df: pd.DataFrame, cols: List[str]) -> pd.MultiIndex:
+    """Distinct combinations of a composite key, without rows that have a null in any key column."""
+    return pd.MultiIndex.from_arrays([df[c] for c in cols]).dropna().drop_duplicates()
+
+
+def _is_string_sample(sample: pd.Series) -> bool:
+    """True if the (non-null) values are text, whatever the string dtype (object, StringDtype, ArrowDtype)."""
+    if sample.dtype == object:
+        return pd.api.types.infer_dtype(sample, skipna=True) == "string"
+    return pd.api.types.is_string_dtype(sample.dtype)
 
 
 def validate_data_before_merge(
@@ -438,28 +722,36 @@ def validate_data_before_merge(
     if errors:
         return {"errors": errors, "warnings": warnings, "info": info}
     
+    # One factorize pass per single key column gives duplicates, nulls and uniques
+    if len(key_a) == 1 and len(key_b) == 1:
+        stats_a, uniques_a = _key_column_profile(df_a[key_a[0]])
+        stats_b, uniques_b = _key_column_profile(df_b[key_b[0]])
+    else:
+        stats_a, uniques_a = _key_column_profile(df_a[key_a[0]]) if len(key_a) == 1 else (None, None)
+        stats_b, uniques_b = _key_column_profile(df_b[key_b[0]]) if len(key_b) == 1 else (None, None)
+    
     # Check for duplicates in keys
-    if len(key_a) == 1:
-        dup_a = df_a[key_a[0]].duplicated().sum()
+    if stats_a is not None:
+        dup_a = stats_a["dup"]
         if dup_a > 0:
             warnings.append(f"Base A tiene {dup_a:,} valores duplicados en la columna clave")
             info["duplicates_a"] = dup_a
     
-    if len(key_b) == 1:
-        dup_b = df_b[key_b[0]].duplicated().sum()
+    if stats_b is not None:
+        dup_b = stats_b["dup"]
         if dup_b > 0:
             warnings.append(f"Base B tiene {dup_b:,} valores duplicados en la columna clave")
             info["duplicates_b"] = dup_b
     
     # Check for nulls in keys
-    if len(key_a) == 1:
-        nulls_a = df_a[key_a[0]].isna().sum()
+    if stats_a is not None:
+        nulls_a = stats_a["null"]
         if nulls_a > 0:
             warnings.append(f"Base A tiene {nulls_a:,} valores nulos en la columna clave")
             info["nulls_a"] = nulls_a
     
-    if len(key_b) == 1:
-        nulls_b = df_b[key_b[0]].isna().sum()
+    if stats_b is not None:
+        nulls_b = stats_b["null"]
         if nulls_b > 0:
             warnings.append(f"Base B tiene {nulls_b:,} valores nulos en la columna clave")
             info["nulls_b"] = nulls_b
@@ -474,7 +766,9 @@ def validate_data_before_merge(
                 # Sample check
                 sample_a = df_a[key_a[0]].dropna().head(100)
                 sample_b = df_b[key_b[0]].dropna().head(100)
-                if len(sample_a) > 0 and len(sample_b) > 0:
+                # Text on both sides (object vs Arrow-backed strings) is compatible
+                both_text = _is_string_sample(sample_a) and _is_string_sample(sample_b)
+                if len(sample_a) > 0 and len(sample_b) > 0 and not both_text:
                     # Try conversion
                     pd.to_numeric(sample_a, errors='coerce')
                     pd.to_numeric(sample_b, errors='coerce')
@@ -484,12 +778,22 @@ def validate_data_before_merge(
     
     # Calculate overlap
     if len(key_a) == 1 and len(key_b) == 1:
-        set_a = set(df_a[key_a[0]].dropna().unique())
-        set_b = set(df_b[key_b[0]].dropna().unique())
-        overlap = len(set_a & set_b)
+        # Keys present on both sides: only the distinct values need to be compared
+        overlap = int(uniques_b.isin(uniques_a).sum())
+        info["overlap"] = overlap
+        info["unique_a"] = stats_a["unique"]
+        info["unique_b"] = stats_b["unique"]
+        
+        if overlap == 0:
+            warnings.append("No hay coincidencias entre las columnas clave. El inner join resultará vacío.")
+    elif len(key_a) == len(key_b):
+        # Composite key: distinct combinations per side, compared level by level in C
+        keys_a = _composite_keys(df_a, key_a)
+        keys_b = _composite_keys(df_b, key_b)
+        overlap = int(keys_b.isin(keys_a).sum())
         info["overlap"] = overlap
-        info["unique_a"] = len(set_a)
-        info["unique_b"] = len(set_b)
+        info["unique_a"] = len(keys_a)
+        info["unique_b"] = len(keys_b)
         
         if overlap == 0:
             warnings.append("No hay coincidencias entre las columnas clave. El inner join resultará vacío.")
@@ -497,22 +801,43 @@ def validate_data_before_merge(
     return {"errors": errors, "warnings": warnings, "info": info}
 
 
-def normalize_data(df: pd.DataFrame, columns: Optional[List[str]] = None) -> pd.DataFrame:
+def _is_text_column(s: pd.Series) -> bool:
+    """
+    True for string-dtype columns and object columns holding text (alone or mixed
+    with other values). Object columns without strings (booleans, numbers, dates)
+    have no .str accessor and are left as they are.
+    """
+    if s.dtype == 'object':
+        return pd.api.types.infer_dtype(s, skipna=True) in ("string", "mixed", "mixed-integer", "empty")
+    return pd.api.types.is_string_dtype(s.dtype)
+
+
+def _strip_text(s: pd.Series) -> pd.Series:
+    """Strip whitespace from text values and turn empty strings into NA."""
+    stripped = s.str.strip()
+    if s.dtype == 'object':
+        # Non-string values (numbers, NaN) are kept as they are, not converted to "nan"/"5"
+        stripped = stripped.where(stripped.notna() | s.isna(), s)
+    return stripped.replace('', pd.NA)
+
+
+def normalize_data(df: pd.DataFrame, columns: Optional[List[str]] = None, copy: bool = True) -> pd.DataFrame:
     """
     Normalize data: strip whitespace, handle case, etc.
+
+    With copy=False the given DataFrame is modified in place (and returned),
+    avoiding a full copy when the caller owns the frame.
     """
-    df = df.copy()
+    if copy:
+        df = df.copy()
     
     if columns is None:
         columns = df.columns.tolist()
     
-    for col in columns:
-        if col in df.columns:
-            # Convert to string and strip whitespace
-            if df[col].dtype == 'object':
-                df[col] = df[col].astype(str).str.strip()
-                # Replace empty strings with NaN
-                df[col] = df[col].replace('', pd.NA)
+    # Only text columns are touched; all of them are stripped in one block
+    text_cols = [col for col in df.columns.intersection(columns).unique() if _is_text_column(df[col])]
+    if text_cols:
+        df[text_cols] = df[text_cols].apply(_strip_text)
     
     return df
 
@@ -522,7 +847,7 @@ def detect_duplicates(df: pd.DataFrame, key: Union[str, List[str]]) -> Dict[str,
     if isinstance(key, str):
         key = [key]
     
-    duplicates = df[df.duplicated(subset=key, keep=False)].copy()
+    duplicates = df[df.duplicated(subset=key, keep=False)]
     
     return {
         "has_duplicates": len(duplicates) > 0,
@@ -532,15 +857,41 @@ def detect_duplicates(df: pd.DataFrame, key: Union[str, List[str]]) -> Dict[str,
     }
 
 
+def estimate_memory_mb(df: pd.DataFrame, sample_rows: int = 10_000) -> float:
+    """
+    Estimate the memory used by a DataFrame in MB.
+
+    Only object columns need the deep (per Python object) scan; it is done on a
+    sample of sample_rows rows and scaled up. Every other dtype is measured exactly.
+    """
+    total = df.memory_usage(deep=False).sum()
+    object_positions = [i for i, dtype in enumerate(df.dtypes) if dtype == object]
+    if object_positions:
+        objects = df.iloc[:, object_positions]
+        scale = 1.0
+        if len(objects) > sample_rows:
+            scale = len(objects) / sample_rows
+            objects = objects.sample(n=sample_rows, random_state=0)
+        deep = objects.memory_usage(index=False, deep=True).sum()
+        shallow = objects.memory_usage(index=False, deep=False).sum()
+        total += (deep - shallow) * scale
+    return float(total) / (1024 * 1024)
+
+
 def analyze_data_quality(df: pd.DataFrame) -> Dict[str, Any]:
     """Analyze data quality metrics for a dataframe."""
+    # One null scan serves both the counts and the percentages
+    null_counts = df.isna().sum()
+    n_rows = len(df)
     quality = {
-        "total_rows": len(df),
+        "total_rows": n_rows,
         "total_columns": len(df.columns),
-        "null_counts": df.isnull().sum().to_dict(),
-        "null_percentages": (df.isnull().sum() / len(df) * 100).to_dict(),
+        "null_counts": null_counts.to_dict(),
+        "null_percentages": (
+            (null_counts * (100.0 / n_rows)).to_dict() if n_rows else {c: 0.0 for c in df.columns}
+        ),
         "dtypes": df.dtypes.to_dict(),
-        "memory_usage_mb": df.memory_usage(deep=True).sum() / (1024 * 1024),
+        "memory_usage_mb": estimate_memory_mb(df),
     }
     
     # Numeric columns stats
@@ -567,9 +918,8 @@ def fix_duplicate_columns(df: pd.DataFrame) -> pd.DataFrame:
     """
     Rename duplicate column names to make them unique.
     Adds a suffix _1, _2, etc. to duplicate column names.
+    The input frame is not modified; without duplicates it is returned as is.
     """
-    df = df.copy()
-    
     # Get column names
     cols = list(df.columns)
     seen = {}
@@ -589,9 +939,71 @@ def fix_duplicate_columns(df: pd.DataFrame) -> pd.DataFrame:
     
     # Only rename if there were duplicates
     if new_cols != cols:
-        df.columns = new_cols
+        # set_axis returns a new frame that shares the data (copy-on-write)
+        df = df.set_axis(new_cols, axis=1)
         logger.info(f"Renombradas columnas duplicadas: {len([c for c in seen.values() if c > 0])} duplicados encontrados")
     
     return df
 
 
+def classify_text_columns(df: pd.DataFrame) -> Dict[str, List[int]]:
+    """
+    Return the positions of the searchable columns, grouped by how they are scanned.
+
+    - "str": object columns holding only strings (no conversion needed)
+    - "mixed": other object columns (values are converted with str())
+    - "arrow": pandas/Arrow string dtypes
+    Numeric, boolean and date columns are not searched.
+    """
+    groups: Dict[str, List[int]] = {"str": [], "mixed": [], "arrow": []}
+    for i, dtype in enumerate(df.dtypes):
+        if dtype == object:
+            kind = pd.api.types.infer_dtype(df.iloc[:, i], skipna=True)
+            groups["str" if kind in ("string", "empty") else "mixed"].append(i)
+        elif pd.api.types.is_string_dtype(dtype):
+            groups["arrow"].append(i)
+    return groups
+
+
+def search_haystack(df: pd.DataFrame, text_columns: Optional[Dict[str, List[int]]] = None) -> pa.Array:
+    """
+    Return one lower-cased string per row joining every searchable column.
+
+    Build it once per frame and pass it to contains_any: each search is then a
+    single case-sensitive substring scan in pyarrow, without lower-casing every
+    row again. text_columns is the output of classify_text_columns.
+    """
+    if text_columns is None:
+        text_columns = classify_text_columns(df)
+    arrays = []
+    for i in text_columns["str"]:
+        arrays.append(pa.array(df.iloc[:, i].to_numpy(), type=pa.large_string(), from_pandas=True))
+    # Only object columns with non-string values need a str() conversion
+    for i in text_columns["mixed"]:
+        col = df.iloc[:, i]
+        arrays.append(pa.array(col.astype(str).where(col.notna()).to_numpy(), type=pa.large_string(), from_pandas=True))
+    for i in text_columns["arrow"]:
+        arrays.append(pa.array(df.iloc[:, i].array).cast(pa.large_string()))
+    if not arrays:
+        return pa.nulls(len(df), type=pa.large_string())
+    separator = pa.scalar("\x01", type=pa.large_string())
+    joined = pc.binary_join_element_wise(*arrays, separator, null_handling="replace", null_replacement="")
+    return pc.utf8_lower(joined)
+
+
+def contains_any(
+    df: pd.DataFrame,
+    needle: str,
+    text_columns: Optional[Dict[str, List[int]]] = None,
+    haystack: Optional[pa.Array] = None,
+) -> np.ndarray:
+    """
+    Return a boolean mask of the rows where any text column contains needle.
+
+    The match is literal and case-insensitive. Pass the search_haystack of df (or the
+    matching slice of it) to reuse it between searches.
+    """
+    if haystack is None:
+        haystack = search_haystack(df, text_columns)
+    hits = pc.match_substring(haystack, needle.lower())
+    return hits.fill_null(False).to_numpy(zero_copy_only=False)
@@ -11,6 +11,19 @@ from merge_utils import (
     analyze_data_quality,
     do_merge,
     anti_join,
+    filter_columns,
+    prune_merge_inputs,
+    build_summary_stats,
+    load_file,
+    key_column_stats,
+    classify_text_columns,
+    search_haystack,
+    contains_any,
+    to_excel_bytes,
+    to_csv_bytes,
+    to_feather_bytes,
+    fix_duplicate_columns,
+    estimate_memory_mb,
 )
 
 
@@ -51,6 +64,18 @@ def test_validate_data_before_merge():
     assert result['info']['overlap'] == 3  # 2, 3, 4 están en ambas
 
 
+def test_validate_data_before_merge_composite_keys():
+    """Test coincidencias con clave compuesta (tipos distintos y nulos)."""
+    df_a = pd.DataFrame({'id': [1, 1, 2, None], 'pais': ['CL', 'CL', 'PE', 'AR']})
+    df_b = pd.DataFrame({'id': [1.0, 2.0, 3.0], 'pais': ['CL', 'CO', None]})
+    
+    result = validate_data_before_merge(df_a, df_b, ['id', 'pais'], ['id', 'pais'])
+    
+    assert result['info']['unique_a'] == 2  # La fila con id nulo no cuenta
+    assert result['info']['unique_b'] == 2
+    assert result['info']['overlap'] == 1  # Solo (1, 'CL')
+
+
 def test_normalize_data():
     """Test normalización de datos."""
     df = pd.DataFrame({
@@ -65,6 +90,34 @@ def test_normalize_data():
     assert normalized['col1'].iloc[2] == 'C'
 
 
+def test_normalize_data_keeps_nulls_and_numbers():
+    """Test que la normalización no convierte nulos ni números en texto."""
+    df = pd.DataFrame({'col1': ['  A ', '   ', None, 5]})
+    
+    normalized = normalize_data(df)
+    
+    assert normalized['col1'].iloc[0] == 'A'
+    assert pd.isna(normalized['col1'].iloc[1])
+    assert pd.isna(normalized['col1'].iloc[2])
+    assert normalized['col1'].iloc[3] == 5
+    assert df['col1'].iloc[0] == '  A '  # El original no se modifica
+
+
+def test_normalize_data_non_text_object_columns():
+    """Test que las columnas object sin texto (booleanos con vacíos) quedan igual."""
+    df = pd.DataFrame({
+        'id': [1, 2],
+        'flag': pd.Series([True, None], dtype=object),
+        'nombre': [' A ', 'B'],
+    })
+    
+    normalized = normalize_data(df)
+    
+    assert normalized['flag'].iloc[0] is True
+    assert pd.isna(normalized['flag'].iloc[1])
+    assert normalized['nombre'].iloc[0] == 'A'
+
+
 def test_detect_duplicates():
     """Test detección de duplicados."""
     df = pd.DataFrame({
@@ -78,6 +131,31 @@ def test_detect_duplicates():
     assert result['duplicate_count'] == 5  # 2 aparece 2 veces, 3 aparece 3 veces = 5 duplicados
 
 
+def test_key_column_stats():
+    """Test métricas de la columna clave en una sola pasada."""
+    series = pd.Series([1, 2, 2, None, None, 3])
+    
+    stats = key_column_stats(series)
+    
+    assert stats['unique'] == series.nunique()
+    assert stats['null'] == series.isna().sum()
+    assert stats['dup'] == series.duplicated().sum()
+
+
+def test_fix_duplicate_columns():
+    """Test renombrado de columnas duplicadas sin modificar el original."""
+    df = pd.DataFrame([[1, 2, 3]], columns=['a', 'b', 'a'])
+    
+    fixed = fix_duplicate_columns(df)
+    
+    assert list(fixed.columns) == ['a', 'b', 'a_1']
+    assert list(df.columns) == ['a', 'b', 'a']
+    assert fixed['a_1'].iloc[0] == 3
+    
+    unique = pd.DataFrame({'x': [1]})
+    assert fix_duplicate_columns(unique) is unique
+
+
 def test_analyze_data_quality():
     """Test análisis de calidad de datos."""
     df = pd.DataFrame({
@@ -95,6 +173,15 @@ def test_analyze_data_quality():
     assert quality['null_counts']['col2'] == 1
 
 
+def test_estimate_memory_mb():
+    """Test estimación de memoria: exacta en bases pequeñas, aproximada con muestra."""
+    df = pd.DataFrame({'texto': ['abc', 'defgh', None] * 10, 'numero': range(30)})
+    exact = df.memory_usage(deep=True).sum() / (1024 * 1024)
+    
+    assert estimate_memory_mb(df) == pytest.approx(exact)
+    assert estimate_memory_mb(df, sample_rows=10) == pytest.approx(exact, rel=0.2)
+
+
 def test_do_merge():
     """Test merge básico."""
     df_a = pd.DataFrame({
@@ -114,6 +201,17 @@ def test_do_merge():
     assert 'value_b' in result.columns
 
 
+def test_do_merge_sorted_keys():
+    """Test que las llaves numéricas ordenadas dan el mismo resultado que pd.merge."""
+    df_a = pd.DataFrame({'id_a': [1, 2, 2, 4, 6], 'valor': ['A', 'B', 'C', 'D', 'E']})
+    df_b = pd.DataFrame({'id_b': [2, 2, 3, 6], 'valor': ['W', 'X', 'Y', 'Z']})
+    
+    for how in ['inner', 'left', 'right', 'outer']:
+        result = do_merge(df_a, df_b, 'id_a', 'id_b', how=how)
+        expected = pd.merge(df_a, df_b, left_on='id_a', right_on='id_b', how=how, suffixes=('_A', '_B'))
+        pd.testing.assert_frame_equal(result, expected)
+
+
 def test_anti_join():
     """Test anti join."""
     df_a = pd.DataFrame({
@@ -132,6 +230,243 @@ def test_anti_join():
     assert all(result['key'].isin([1, 4]))
 
 
+def test_anti_join_keeps_index_and_null_keys():
+    """Test que el anti join conserva el índice original y no empareja llaves nulas."""
+    df_a = pd.DataFrame({'key': [1, None, 3]}, index=[10, 20, 30])
+    df_b = pd.DataFrame({'key': [3, None]})
+    
+    result = anti_join(df_a, df_b, 'key', 'key', direction='A_not_in_B')
+    
+    assert result.index.tolist() == [10, 20]
+
+
+def test_anti_join_multiple_keys():
+    """Test anti join con llave compuesta (las filas con nulos en la llave nunca coinciden)."""
+    df_a = pd.DataFrame({
+        'k1': ['a', 'a', 'b', 'b', None],
+        'k2': [1, 2, 1, 2, 1],
+        'valor': [10, 20, 30, 40, 50]
+    })
+    df_b = pd.DataFrame({
+        'c1': ['a', 'b', None],
+        'c2': [1.0, 2.0, 1.0]
+    })
+    
+    result = anti_join(df_a, df_b, ['k1', 'k2'], ['c1', 'c2'], direction='A_not_in_B')
+    assert result['valor'].tolist() == [20, 30, 50]
+    
+    result = anti_join(df_a, df_b, ['k1', 'k2'], ['c1', 'c2'], direction='B_not_in_A')
+    assert len(result) == 1 and pd.isna(result['c1'].iloc[0])
+
+
+def test_prune_merge_inputs_same_result():
+    """Test que podar columnas antes del merge no cambia el resultado filtrado."""
+    df_a = pd.DataFrame({
+        'id': [1, 2, 3],
+        'nombre': ['A', 'B', 'C'],
+        'monto': [10, 20, 30],
+        'extra_a': ['x', 'y', 'z']
+    })
+    df_b = pd.DataFrame({
+        'codigo': [2, 3, 4],
+        'nombre': ['B2', 'C2', 'D2'],
+        'extra_b': [True, False, True]
+    })
+    
+    for how in ['inner', 'left', 'right', 'outer']:
+        for cols_a, cols_b in [(['nombre'], ['extra_b']), (['id', 'monto'], ['nombre']), ([], [])]:
+            full = filter_columns(
+                do_merge(df_a, df_b, 'id', 'codigo', how=how), cols_a, cols_b, key_a='id', key_b='codigo'
+            )
+            pruned_a, pruned_b = prune_merge_inputs(df_a, df_b, 'id', 'codigo', cols_a, cols_b)
+            pruned = filter_columns(
+                do_merge(pruned_a, pruned_b, 'id', 'codigo', how=how), cols_a, cols_b, key_a='id', key_b='codigo'
+            )
+            pd.testing.assert_frame_equal(pruned, full)
+
+
+def test_build_summary_stats():
+    """Test métricas de llaves, incluyendo nulos y anti join."""
+    df_a = pd.DataFrame({'key': [1, 2, 2, 3, None]})
+    df_b = pd.DataFrame({'key': [2, 3, 4, None]})
+    
+    stats = build_summary_stats(df_a, df_b, 'key', 'key', 'inner', df_a.head(3))
+    
+    assert stats['rows_a'] == 5
+    assert stats['rows_result'] == 3
+    assert stats['unique_keys_a'] == 3
+    assert stats['unique_keys_b'] == 3
+    assert stats['keys_matched'] == 2
+    
+    anti = anti_join(df_a, df_b, 'key', 'key', direction='A_not_in_B')
+    stats = build_summary_stats(df_a, df_b, 'key', 'key', 'anti_A_vs_B', anti)
+    assert stats['excluded_rows'] == len(anti) == 2  # 1 y el nulo
+
+
+def test_load_file_from_path(tmp_path):
+    """Test carga de CSV desde una ruta en disco."""
+    path = tmp_path / "base.csv"
+    path.write_text("id,nombre\n001,A\n002,\n", encoding="utf-8")
+    
+    df = load_file(str(path), preserve_format=True)
+    
+    assert list(df.columns) == ['id', 'nombre']
+    assert df['id'].tolist() == ['001', '002']  # Formato preservado
+    assert pd.isna(df['nombre'].iloc[1])
+
+
+def test_load_file_infers_types(tmp_path):
+    """Test carga de CSV infiriendo tipos como pandas (las fechas quedan como texto)."""
+    path = tmp_path / "tipos.csv"
+    path.write_text("id,fecha,monto,nombre\n1,2024-01-31,1.5,A\n2,2024-02-01,NA,\n", encoding="utf-8")
+    
+    df = load_file(str(path))
+    
+    assert df['id'].tolist() == [1, 2]
+    assert df['fecha'].tolist() == ['2024-01-31', '2024-02-01']
+    assert df['monto'].dtype == 'float64'
+    assert pd.isna(df['monto'].iloc[1])
+    assert pd.isna(df['nombre'].iloc[1])
+
+
+def test_load_file_long_ids_and_empty_columns(tmp_path):
+    """Test IDs más largos que int64 (sin perder dígitos) y columnas vacías."""
+    path = tmp_path / "ids.csv"
+    path.write_text("id,vacia\n99999999999999999999,\n1,\n", encoding="utf-8")
+    
+    df = load_file(str(path))
+    
+    assert df['id'].tolist() == ['99999999999999999999', '1']
+    assert df['vacia'].dtype == 'float64'
+    assert df['vacia'].isna().all()
+
+
+def test_load_file_excel(tmp_path):
+    """Test carga de Excel preservando formatos."""
+    path = tmp_path / "base.xlsx"
+    pd.DataFrame({'id': ['001', '002'], 'nombre': ['A', None]}).to_excel(path, index=False)
+    
+    df = load_file(str(path), preserve_format=True)
+    
+    assert df['id'].tolist() == ['001', '002']
+    assert pd.isna(df['nombre'].iloc[1])
+
+
+def test_validate_csv_and_excel_text_keys(tmp_path):
+    """Test que una base CSV y una Excel leídas como texto no se marcan con tipos distintos."""
+    csv_path = tmp_path / "a.csv"
+    csv_path.write_text("id,valor\n001,x\n002,y\n", encoding="utf-8")
+    xlsx_path = tmp_path / "b.xlsx"
+    pd.DataFrame({'id': ['002', '003'], 'otro': ['p', None]}).to_excel(xlsx_path, index=False)
+    
+    df_a = load_file(str(csv_path), preserve_format=True)
+    df_b = load_file(str(xlsx_path), preserve_format=True)
+    result = validate_data_before_merge(df_a, df_b, 'id', 'id')
+    
+    assert not any('Tipos de datos diferentes' in w for w in result['warnings'])
+    assert result['info']['overlap'] == 1
+    
+    # Tipos realmente distintos (número vs texto) siguen advirtiéndose
+    df_num = pd.DataFrame({'id': [2, 3]})
+    result = validate_data_before_merge(df_a, df_num, 'id', 'id')
+    assert any('Tipos de datos diferentes' in w for w in result['warnings'])
+
+
+def test_load_file_duplicated_headers(tmp_path):
+    """Test CSV con encabezados repetidos (se renombran como en pandas)."""
+    path = tmp_path / "dup.csv"
+    path.write_text("id,id\n1,2\n", encoding="utf-8")
+    
+    df = load_file(str(path), preserve_format=True)
+    
+    assert list(df.columns) == ['id', 'id.1']
+
+
+def test_contains_any():
+    """Test búsqueda literal sin distinguir mayúsculas en columnas de texto."""
+    df = pd.DataFrame({
+        'nombre': ['Ana', None, 'Luis'],
+        'codigo': pd.Series(['x.1', 'AB', None], dtype='string[pyarrow]'),
+        'monto': [1, 2, 3]
+    })
+    
+    assert contains_any(df, 'an').tolist() == [True, False, False]
+    assert contains_any(df, 'ab').tolist() == [False, True, False]
+    assert contains_any(df, '.').tolist() == [True, False, False]  # Búsqueda literal
+    assert not contains_any(df, 'none').any()  # Los nulos no coinciden
+    
+    # Columnas object con valores no texto se buscan como str()
+    df['mixto'] = [10, 'x', None]
+    assert classify_text_columns(df) == {'str': [0], 'mixed': [3], 'arrow': [1]}
+    assert contains_any(df, '10').tolist() == [True, False, False]
+    
+    # El texto preparado se puede reutilizar entre búsquedas
+    haystack = search_haystack(df)
+    assert contains_any(df, 'LUIS', haystack=haystack).tolist() == [False, False, True]
+
+
+def test_to_excel_bytes_roundtrip():
+    """Test que el Excel generado conserva valores, textos y nulos."""
+    from io import BytesIO
+    
+    df = pd.DataFrame({
+        'id': ['001', '002', '003'],
+        'nombre': ['Ana', None, 'Luis'],
+        'monto': [1.5, 2.0, 3.25]
+    })
+    
+    result = pd.read_excel(BytesIO(to_excel_bytes(df)), dtype={'id': str})
+    
+    assert result['id'].tolist() == ['001', '002', '003']
+    assert result['monto'].tolist() == [1.5, 2.0, 3.25]
+    assert result['nombre'].iloc[0] == 'Ana'
+    assert pd.isna(result['nombre'].iloc[1])
+
+
+def test_to_csv_bytes():
+    """Test que el CSV escrito con pyarrow se lee igual que el de pandas."""
+    from io import BytesIO
+    
+    df = pd.DataFrame({
+        'id': ['001', '002', '003'],
+        'nombre': ['Ana', None, 'Pérez, "Luis"'],
+        'cantidad': [1, 2, 3]
+    })
+    
+    fast = pd.read_csv(BytesIO(to_csv_bytes(df)), dtype={'id': str})
+    slow = pd.read_csv(BytesIO(df.to_csv(index=False).encode('utf-8')), dtype={'id': str})
+    pd.testing.assert_frame_equal(fast, slow)
+    
+    # Con columnas float se usa el formato de pandas
+    df['monto'] = [1.0, 2.5, None]
+    assert to_csv_bytes(df) == df.to_csv(index=False).encode('utf-8')
+    
+    # Una sola columna con nulos: ninguna fila se pierde como línea vacía
+    solo_llave = pd.DataFrame({'id': ['a', None, 'b', None, 'c']})
+    leido = pd.read_csv(BytesIO(to_csv_bytes(solo_llave)))
+    assert len(leido) == 5
+    assert leido['id'].isna().sum() == 2
+    
+    # Varias columnas con una fila completamente nula
+    con_fila_nula = pd.DataFrame({'id': ['a', None], 'nombre': ['b', None]})
+    assert len(pd.read_csv(BytesIO(to_csv_bytes(con_fila_nula)))) == 2
+
+
+def test_to_feather_bytes_roundtrip():
+    """Test que el Feather generado se lee igual que el DataFrame original."""
+    from io import BytesIO
+    
+    df = pd.DataFrame({
+        'id': ['001', '002'],
+        'nombre': ['Ana', None],
+        'monto': [1.5, 2.0]
+    })
+    
+    result = pd.read_feather(BytesIO(to_feather_bytes(df)))
+    
+    pd.testing.assert_frame_equal(result, df)
+
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
 